@@ -0,0 +1,712 @@
+import streamlit as st
+import asyncio
+import hashlib
+import httpx
+import os
+import re
+import sqlite3
+import threading
+import time
+import orjson
+import openai
+from collections import deque
+from contextlib import closing
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, OpenAI
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+
+# Read .env once per process; the page script itself re-runs on every interaction
+load_dotenv()
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+
+# All four sections share one request, so the model is chosen once; gpt-4o-mini
+# is the cheap tier ai_inference already uses, and OPENAI_MODEL overrides it
+MODEL = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
+EMBEDDING_MODEL = "text-embedding-3-small"
+SIMILARITY_THRESHOLD = 0.97
+CACHE_TTL = 3600
+# Exact-match and near-duplicate responses both survive restarts here
+LLM_CACHE_PATH = ".llm_cache.db"
+MAX_INPUT_TOKENS = 3000
+# Room for all four sections of the combined reply, well inside the model's limit
+MAX_OUTPUT_TOKENS = 3000
+# Enough characters to cover the token budget even for whitespace-heavy text
+PDF_CHAR_BUDGET = MAX_INPUT_TOKENS * 8
+# Rough size of a token, used only if the tokenizer can't be loaded
+CHARS_PER_TOKEN = 4
+
+# Bounded timeouts and a warm keep-alive pool; retries are handled by openai_retry
+HTTP_TIMEOUT = httpx.Timeout(60.0, connect=5.0)
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=8, keepalive_expiry=300)
+# Per-request override; a bare float would also replace the 5 s connect bound
+REQUEST_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+# Default OpenAI account limits, shared by every session in this process
+REQUESTS_PER_MINUTE = 60
+TOKENS_PER_MINUTE = 150_000
+
+# The agreement goes first, in its own system message, so repeat requests for
+# the same document share a prefix that OpenAI's prompt cache can reuse
+DOCUMENT_PROMPT_TEMPLATE = "You are reviewing the following rental agreement.\n\nText: {text}..."
+
+# All pending steps go out as one request; the reply is split back into
+# per-step sections on these marker lines
+COMBINED_PROMPT_TEMPLATE = (
+    "Complete each of the following tasks for the rental agreement. "
+    "Begin the answer to each task with its marker line exactly as shown, "
+    "answer the tasks in order, and write nothing before the first marker.\n\n"
+    "{tasks}"
+)
+SECTION_MARKER = "### [{key}]"
+SECTION_PATTERN = re.compile(r"^###\s*\[(\w+)\][ \t]*$")
+
+# Batch replies aren't streamed, so they use JSON mode and parse in one step
+JSON_PROMPT_TEMPLATE = (
+    "Complete each of the following tasks for the rental agreement. "
+    "Reply with a JSON object that has one string value per task, keyed by "
+    "the name in square brackets on the task's first line.\n\n"
+    "{tasks}"
+)
+BATCH_CUSTOM_ID = "combined"
+# Matches completion_window; a batch ID older than this can no longer finish
+BATCH_WINDOW = 24 * 3600
+
+# reuse_similar marks steps whose answer carries over to a near-duplicate lease.
+# Steps that quote the document's own facts (address, rent, names, dates) are
+# only ever served from the exact cache, never from a similar document
+STEPS = {
+    "Initial Analysis": {
+        "prompt": (
+            "Analyze this rental agreement and extract:\n"
+            "1. Rental property address\n"
+            "2. Monthly rent amount\n"
+            "3. Lease term\n"
+            "4. Security deposit amount\n"
+            "5. Tenant names"
+        ),
+        "key": "analysis",
+        "reuse_similar": False
+    },
+    "Legal Validation": {
+        "prompt": (
+            "Check for potential legal issues regarding:\n"
+            "1. Fair housing compliance\n"
+            "2. Legal rent increase provisions\n"
+            "3. Security deposit regulations\n"
+            "4. Maintenance responsibilities\n"
+            "5. Privacy rights"
+        ),
+        "key": "validation",
+        "reuse_similar": False
+    },
+    "Summary": {
+        "prompt": (
+            "Create a plain language summary including:\n"
+            "1. Key dates and deadlines\n"
+            "2. Main tenant responsibilities\n"
+            "3. Landlord obligations\n"
+            "4. Important restrictions\n"
+            "5. Termination conditions"
+        ),
+        "key": "summary",
+        "reuse_similar": False
+    },
+    "Recommendations": {
+        "prompt": (
+            "Suggest improvements considering:\n"
+            "1. Clarity improvements\n"
+            "2. Additional protections needed\n"
+            "3. Modern considerations\n"
+            "4. Legal compliance\n"
+            "5. Dispute resolution"
+        ),
+        "key": "recommendations",
+        "reuse_similar": True
+    }
+}
+
+# Each step's task block, marker line included, built once at import
+STEP_TASKS = {
+    info["key"]: f"{SECTION_MARKER.format(key=info['key'])}\n{info['prompt']}"
+    for info in STEPS.values()
+}
+
+@st.cache_resource
+def get_openai_client():
+    # One shared client (and connection pool) for every rerun and session
+    if not OPENAI_API_KEY:
+        st.error("No OpenAI API key found in .env file.")
+        st.stop()
+    return OpenAI(
+        api_key=OPENAI_API_KEY,
+        max_retries=0,
+        http_client=httpx.Client(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+    )
+
+def hash_document(pdf_bytes: bytes) -> str:
+    return hashlib.blake2b(pdf_bytes, digest_size=16).hexdigest()
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def extract_text_from_pdf_bytes(_pdf_bytes: bytes, doc_hash: str) -> str:
+    # Cached on the document hash so reruns don't re-parse the same PDF;
+    # the leading underscore stops Streamlit from hashing the raw bytes again.
+    # The text is also kept in .llm_cache.db, under the same TTL as the
+    # responses, so a lease seen before a restart is not re-parsed.
+    # Errors propagate to the caller so a failed read is never cached
+    text = get_stored_text(doc_hash)
+    if text is None:
+        text = read_pdf_text(_pdf_bytes)
+        store_text(doc_hash, text)
+    return text
+
+def read_pdf_text(pdf_bytes):
+    import pypdfium2 as pdfium
+    from utilities.documents import PDFIUM_LOCK
+
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        parts = []
+        total = 0
+        try:
+            for page in pdf:
+                textpage = page.get_textpage()
+                page_text = textpage.get_text_range().replace("\r\n", "\n")
+                textpage.close()
+                page.close()
+                parts.append(page_text)
+                total += len(page_text)
+                # Later pages would be cut by the token budget anyway
+                if total >= PDF_CHAR_BUDGET:
+                    break
+        finally:
+            pdf.close()
+    return "".join(parts)
+
+@st.cache_resource
+def get_encoding():
+    # Loaded on first use rather than at import, and only once per process
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(MODEL)
+    except KeyError:
+        # OPENAI_MODEL may name a model the pinned tiktoken can't map;
+        # o200k_base is the encoding of every current OpenAI chat model
+        return tiktoken.get_encoding("o200k_base")
+
+def truncate_to_tokens(text, max_tokens=MAX_INPUT_TOKENS):
+    # Bound the prompt by tokens rather than characters so cost is predictable
+    try:
+        encoding = get_encoding()
+    except Exception:
+        # The BPE file is downloaded on first use; without it, cut by characters
+        return text[:max_tokens * CHARS_PER_TOKEN]
+    # Lease text is data, so strings like <|endoftext|> are encoded as plain text
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+class TokenBudget:
+    """Sliding one-minute window of requests and tokens sent to OpenAI."""
+
+    def __init__(self, requests_per_minute, tokens_per_minute, window=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window = window
+        self.sent = deque()
+        self.lock = threading.Lock()
+
+    def reserve(self, tokens):
+        # Records the request and returns 0 if it fits, else seconds to wait
+        with self.lock:
+            now = time.monotonic()
+            while self.sent and now - self.sent[0][0] >= self.window:
+                self.sent.popleft()
+            used = sum(count for _, count in self.sent)
+            if not self.sent or (
+                len(self.sent) < self.requests_per_minute
+                and used + tokens <= self.tokens_per_minute
+            ):
+                self.sent.append((now, tokens))
+                return 0
+            return self.window - (now - self.sent[0][0])
+
+    def acquire(self, tokens):
+        while (wait := self.reserve(tokens)) > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens):
+        while (wait := self.reserve(tokens)) > 0:
+            await asyncio.sleep(wait)
+
+@st.cache_resource
+def get_token_budget():
+    return TokenBudget(REQUESTS_PER_MINUTE, TOKENS_PER_MINUTE)
+
+def count_tokens(text):
+    try:
+        encoding = get_encoding()
+    except Exception:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def build_messages(prompt, text):
+    return [
+        {"role": "system", "content": DOCUMENT_PROMPT_TEMPLATE.format(text=text)},
+        {"role": "user", "content": prompt}
+    ]
+
+def build_combined_prompt(steps, template=COMBINED_PROMPT_TEMPLATE):
+    tasks = "\n\n".join(STEP_TASKS[info["key"]] for info in steps.values())
+    return template.format(tasks=tasks)
+
+def parse_json_sections(response):
+    try:
+        sections = orjson.loads(response)
+    except orjson.JSONDecodeError:
+        return {}
+    if not isinstance(sections, dict):
+        return {}
+    return {key: value.strip() for key, value in sections.items() if isinstance(value, str)}
+
+def notify_retry(retry_state):
+    st.toast(f"OpenAI request failed, retrying (attempt {retry_state.attempt_number})...")
+
+# The clients are built with max_retries=0, so this is the only retry policy.
+# Rate limits, dropped connections, timeouts (APITimeoutError is an
+# APIConnectionError) and server errors are transient;
+# anything else is re-raised straight away to the caller's error handling
+openai_retry = retry(
+    wait=wait_random_exponential(multiplier=1, min=2, max=20),
+    stop=stop_after_attempt(3),
+    retry=retry_if_exception_type((
+        openai.RateLimitError,
+        openai.APIConnectionError,
+        openai.InternalServerError
+    )),
+    before_sleep=notify_retry,
+    reraise=True
+)
+
+# For non-idempotent requests that may already have been accepted when a
+# timeout or server error comes back; a 429 is the only safe retry there
+rate_limit_retry = retry(
+    wait=wait_random_exponential(multiplier=1, min=2, max=20),
+    stop=stop_after_attempt(3),
+    retry=retry_if_exception_type(openai.RateLimitError),
+    before_sleep=notify_retry,
+    reraise=True
+)
+
+@openai_retry
+async def call_openai(client, prompt, text):
+    await get_token_budget().acquire_async(
+        count_tokens(prompt) + count_tokens(text) + MAX_OUTPUT_TOKENS
+    )
+    return await client.with_options(timeout=REQUEST_TIMEOUT).chat.completions.create(
+        model=MODEL,
+        messages=build_messages(prompt, text),
+        max_tokens=MAX_OUTPUT_TOKENS,
+        stream=True
+    )
+
+@st.cache_resource(ttl=CACHE_TTL)
+def get_response_cache():
+    # Shared by all sessions: exact responses keyed by hash, plus
+    # (prompt, embedding, response) entries for near-duplicate documents,
+    # seeded from the on-disk cache so a restart keeps its similarity hits
+    return {"exact": {}, "similar": load_similar_responses()}
+
+def response_cache_key(prompt, text):
+    return hashlib.sha256(f"{MODEL}|{prompt}|{text}".encode()).hexdigest()
+
+def purge_expired(connection):
+    # Rows are filtered by age on read; deleting them too keeps lease-derived
+    # text from piling up on disk
+    now = time.time()
+    connection.execute("DELETE FROM responses WHERE created < ?", (now - CACHE_TTL,))
+    connection.execute("DELETE FROM similar WHERE created < ?", (now - CACHE_TTL,))
+    connection.execute("DELETE FROM batches WHERE created < ?", (now - BATCH_WINDOW,))
+    connection.execute("DELETE FROM texts WHERE created < ?", (now - CACHE_TTL,))
+
+@st.cache_resource
+def init_llm_cache_db():
+    with closing(sqlite3.connect(LLM_CACHE_PATH)) as connection, connection:
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses "
+            "(key TEXT PRIMARY KEY, response TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS similar "
+            "(key TEXT PRIMARY KEY, prompt TEXT NOT NULL, embedding BLOB NOT NULL, "
+            "response TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS batches "
+            "(key TEXT PRIMARY KEY, batch_id TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS texts "
+            "(key TEXT PRIMARY KEY, text TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        purge_expired(connection)
+    return LLM_CACHE_PATH
+
+def get_exact_response(prompt, text):
+    # Memory first, then the on-disk cache shared with earlier server runs
+    key = response_cache_key(prompt, text)
+    response = get_response_cache()["exact"].get(key)
+    if response:
+        return response
+    try:
+        with closing(sqlite3.connect(init_llm_cache_db())) as connection:
+            row = connection.execute(
+                "SELECT response FROM responses WHERE key = ? AND created >= ?",
+                (key, time.time() - CACHE_TTL)
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    if row:
+        get_response_cache()["exact"][key] = row[0]
+        return row[0]
+    return None
+
+def store_exact_response(key, response):
+    try:
+        with closing(sqlite3.connect(init_llm_cache_db())) as connection, connection:
+            purge_expired(connection)
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, created) VALUES (?, ?, ?)",
+                (key, response, time.time())
+            )
+    except sqlite3.Error:
+        pass
+
+def text_cache_key(doc_hash):
+    # The budget is part of the key so a new MAX_INPUT_TOKENS re-extracts
+    return f"{doc_hash}|{PDF_CHAR_BUDGET}"
+
+def get_stored_text(doc_hash):
+    try:
+        with closing(sqlite3.connect(init_llm_cache_db())) as connection:
+            row = connection.execute(
+                "SELECT text FROM texts WHERE key = ? AND created >= ?",
+                (text_cache_key(doc_hash), time.time() - CACHE_TTL)
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+def store_text(doc_hash, text):
+    try:
+        with closing(sqlite3.connect(init_llm_cache_db())) as connection, connection:
+            purge_expired(connection)
+            connection.execute(
+                "INSERT OR REPLACE INTO texts (key, text, created) VALUES (?, ?, ?)",
+                (text_cache_key(doc_hash), text, time.time())
+            )
+    except sqlite3.Error:
+        pass
+
+def similar_prompts():
+    return [info["prompt"] for info in STEPS.values() if info["reuse_similar"]]
+
+def load_similar_responses():
+    import numpy as np
+
+    # Rows for fact-extraction steps (or prompts that have since changed)
+    # must never come back, so they are dropped rather than skipped
+    prompts = similar_prompts()
+    placeholders = ", ".join("?" * len(prompts))
+    try:
+        with closing(sqlite3.connect(init_llm_cache_db())) as connection, connection:
+            connection.execute(f"DELETE FROM similar WHERE prompt NOT IN ({placeholders})", prompts)
+            rows = connection.execute(
+                "SELECT prompt, embedding, response FROM similar WHERE created >= ?",
+                (time.time() - CACHE_TTL,)
+            ).fetchall()
+    except sqlite3.Error:
+        return []
+    return [(prompt, np.frombuffer(embedding, dtype=np.float32), response) for prompt, embedding, response in rows]
+
+def store_similar_response(key, prompt, embedding, response):
+    import numpy as np
+
+    if prompt not in similar_prompts():
+        return
+    try:
+        with closing(sqlite3.connect(init_llm_cache_db())) as connection, connection:
+            purge_expired(connection)
+            connection.execute(
+                "INSERT OR REPLACE INTO similar (key, prompt, embedding, response, created) VALUES (?, ?, ?, ?, ?)",
+                (key, prompt, np.asarray(embedding, dtype=np.float32).tobytes(), response, time.time())
+            )
+    except sqlite3.Error:
+        pass
+
+@openai_retry
+def create_embedding(client, text):
+    get_token_budget().acquire(count_tokens(text))
+    return client.with_options(timeout=REQUEST_TIMEOUT).embeddings.create(
+        model=EMBEDDING_MODEL,
+        input=text
+    )
+
+def embed_text(client, text):
+    import numpy as np
+
+    try:
+        response = create_embedding(client, text)
+    except Exception:
+        return None
+    embedding = np.array(response.data[0].embedding)
+    return embedding / np.linalg.norm(embedding)
+
+def find_similar_response(prompt, embedding):
+    import numpy as np
+
+    best_score, best_response = SIMILARITY_THRESHOLD, None
+    for cached_prompt, cached_embedding, response in get_response_cache()["similar"]:
+        if cached_prompt != prompt:
+            continue
+        score = float(np.dot(embedding, cached_embedding))
+        if score >= best_score:
+            best_score, best_response = score, response
+    return best_response
+
+def cache_response(prompt, text, embedding, response):
+    cache = get_response_cache()
+    key = response_cache_key(prompt, text)
+    cache["exact"][key] = response
+    store_exact_response(key, response)
+    if embedding is not None:
+        cache["similar"].append((prompt, embedding, response))
+        store_similar_response(key, prompt, embedding, response)
+
+def load_cached_results(client, steps, text):
+    # Exact matches first; only embed the document if a step that may reuse a
+    # similar lease's answer is still missing. Fact-extraction steps never do
+    missing = []
+    for info in steps.values():
+        if info["key"] in st.session_state.results:
+            continue
+        response = get_exact_response(info["prompt"], text)
+        if response:
+            st.session_state.results[info["key"]] = response
+        elif info["reuse_similar"]:
+            missing.append(info)
+
+    if not missing or st.session_state.embedding_failed:
+        return
+    if st.session_state.embedding is None:
+        st.session_state.embedding = embed_text(client, text)
+    if st.session_state.embedding is None:
+        # The similarity tier is optional; don't pay the retries again on every rerun
+        st.session_state.embedding_failed = True
+        return
+    for info in missing:
+        response = find_similar_response(info["prompt"], st.session_state.embedding)
+        if response:
+            st.session_state.results[info["key"]] = response
+
+def complete_step(title, info, text, result, panel):
+    st.session_state.results[info["key"]] = result
+    # Only steps that may be reused across leases enter the similarity tier
+    embedding = st.session_state.embedding if info["reuse_similar"] else None
+    cache_response(info["prompt"], text, embedding, result)
+    status, placeholder = panel
+    placeholder.markdown(result)
+    status.update(label=f"{title} completed!", state="complete")
+
+async def run_all(api_key, text, steps, panels):
+    # One streamed request covers every pending step. Each section of the
+    # reply goes to its own panel, and a step is completed as soon as the
+    # next section starts
+    titles = {info["key"]: title for title, info in steps.items()}
+    section_lines = {key: [] for key in titles}
+    current_key = None
+
+    def finish(key):
+        title = titles[key]
+        section = "\n".join(section_lines[key]).strip()
+        if section and key not in st.session_state.results:
+            complete_step(title, steps[title], text, section, panels[title])
+
+    def consume(line):
+        nonlocal current_key
+        match = SECTION_PATTERN.match(line)
+        if match:
+            if current_key:
+                finish(current_key)
+            current_key = match.group(1) if match.group(1) in titles else None
+        elif current_key:
+            section_lines[current_key].append(line)
+
+    # The async pool is bound to this event loop, so it lives for one run only
+    async with AsyncOpenAI(
+        api_key=api_key,
+        max_retries=0,
+        http_client=httpx.AsyncClient(timeout=HTTP_TIMEOUT, limits=HTTP_LIMITS)
+    ) as client:
+        try:
+            stream = await call_openai(client, build_combined_prompt(steps), text)
+            partial_line = ""
+            finish_reason = None
+            async for chunk in stream:
+                if chunk.choices and chunk.choices[0].finish_reason:
+                    finish_reason = chunk.choices[0].finish_reason
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                # Only newly completed lines are parsed, rather than re-joining
+                # and re-splitting the whole reply on every chunk
+                lines = (partial_line + delta).split("\n")
+                partial_line = lines.pop()
+                for line in lines:
+                    consume(line)
+                if current_key and not partial_line.startswith("###"):
+                    panels[titles[current_key]][1].markdown(
+                        "\n".join(section_lines[current_key] + [partial_line])
+                    )
+            consume(partial_line)
+            # A section cut off by the output budget is left failed rather than cached
+            if current_key and finish_reason == "length":
+                st.error(
+                    f"{titles[current_key]} was cut off at the {MAX_OUTPUT_TOKENS}-token "
+                    "output limit, so it was not saved and will be requested again."
+                )
+            elif current_key:
+                finish(current_key)
+        except Exception as e:
+            st.error(f"Error with GPT analysis: {str(e)}")
+
+    for key, title in titles.items():
+        if key not in st.session_state.results:
+            panels[title][0].update(label=f"{title} failed", state="error")
+
+@openai_retry
+def upload_batch_file(client, steps, text):
+    # One combined request per document; the Batch API bills it at half price
+    line = orjson.dumps({
+        "custom_id": BATCH_CUSTOM_ID,
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": MODEL,
+            "messages": build_messages(build_combined_prompt(steps, JSON_PROMPT_TEMPLATE), text),
+            "max_tokens": MAX_OUTPUT_TOKENS,
+            "response_format": {"type": "json_object"}
+        }
+    })
+    batch_file = client.files.create(
+        file=("batch.jsonl", line),
+        purpose="batch"
+    )
+    return batch_file.id
+
+@rate_limit_retry
+def create_batch(client, input_file_id):
+    # Retrying a timed-out create could start a second paid batch
+    batch = client.batches.create(
+        input_file_id=input_file_id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h"
+    )
+    return batch.id
+
+def submit_batch(client, steps, text):
+    return create_batch(client, upload_batch_file(client, steps, text))
+
+def get_pending_batch(key):
+    try:
+        with closing(sqlite3.connect(init_llm_cache_db())) as connection:
+            row = connection.execute(
+                "SELECT batch_id FROM batches WHERE key = ? AND created >= ?",
+                (key, time.time() - BATCH_WINDOW)
+            ).fetchone()
+    except sqlite3.Error:
+        return None
+    return row[0] if row else None
+
+def store_pending_batch(key, batch_id):
+    try:
+        with closing(sqlite3.connect(init_llm_cache_db())) as connection, connection:
+            if batch_id is None:
+                connection.execute("DELETE FROM batches WHERE key = ?", (key,))
+            else:
+                connection.execute(
+                    "INSERT OR REPLACE INTO batches (key, batch_id, created) VALUES (?, ?, ?)",
+                    (key, batch_id, time.time())
+                )
+    except sqlite3.Error:
+        pass
+
+@openai_retry
+def collect_batch(client, batch_id):
+    batch = client.batches.retrieve(batch_id)
+    if batch.status != "completed" or not batch.output_file_id:
+        return batch.status, {}
+
+    responses = {}
+    for line in client.files.content(batch.output_file_id).content.splitlines():
+        record = orjson.loads(line)
+        response = record.get("response")
+        if response and response["status_code"] == 200:
+            responses[record["custom_id"]] = response["body"]["choices"][0]["message"]["content"]
+    return batch.status, responses
+
+def run_batch(client, text, steps, panels):
+    # The batch ID lives in session state so reruns poll instead of resubmitting,
+    # and on disk so a browser refresh picks the same batch back up
+    batch_key = response_cache_key(build_combined_prompt(steps, JSON_PROMPT_TEMPLATE), text)
+    try:
+        if st.session_state.batch_id is None:
+            st.session_state.batch_id = get_pending_batch(batch_key)
+        if st.session_state.batch_id is None:
+            st.session_state.batch_id = submit_batch(client, steps, text)
+            store_pending_batch(batch_key, st.session_state.batch_id)
+        batch_status, responses = collect_batch(client, st.session_state.batch_id)
+    except Exception as e:
+        st.error(f"Error with batch analysis: {str(e)}")
+        return
+
+    finished = batch_status in ("completed", "failed", "expired", "cancelled")
+    sections = parse_json_sections(responses.get(BATCH_CUSTOM_ID, "{}"))
+    missing = False
+    for title, info in steps.items():
+        result = sections.get(info["key"])
+        if result:
+            complete_step(title, info, text, result, panels[title])
+        elif finished:
+            # A finished batch won't produce this section, so don't leave it waiting
+            missing = True
+            panels[title][0].update(label=f"{title} failed", state="error")
+        else:
+            panels[title][0].update(label=f"{title}: waiting for batch ({batch_status})...")
+
+    if finished:
+        if batch_status != "completed":
+            st.error(f"Batch {batch_status}, please try again.")
+        elif missing:
+            st.error("Batch completed without a usable result for every step, please try again.")
+        st.session_state.batch_id = None
+        store_pending_batch(batch_key, None)
+    else:
+        st.button("🔄 Check Batch Status")
+
+def create_report(results, generated):
+    report = []
+    report.append("=" * 50)
+    report.append("RENTAL AGREEMENT ANALYSIS REPORT")
+    report.append("=" * 50)
+    report.append(f"\nGenerated: {generated.strftime('%Y-%m-%d %H:%M:%S')}\n")
+    
+    for title, content in results.items():
+        report.append("\n" + "=" * 30)
+        report.append(title.upper())
+        report.append("=" * 30 + "\n")
+        report.append(content)
+        report.append("\n")
+    
+    return "\n".join(report)
@@ -1,8 +1,17 @@
 import streamlit as st
 import os
 import base64
-import PyPDF2
-import io
+import multiprocessing
+import threading
+import pypdfium2 as pdfium
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+# Pages handed to each worker process; documents that fit in one batch are read serially
+PAGES_PER_TASK = 10
+# PDFium is not thread-safe, even across separate documents, and every
+# Streamlit session runs in its own thread: hold this around all pdfium calls
+PDFIUM_LOCK = threading.Lock()
 
 def upload_document(document_folder):
     uploaded_file = st.file_uploader("Choose a PDF file to upload", type=["pdf"])
@@ -15,16 +24,48 @@ def upload_document(document_folder):
                 f.write(uploaded_file.getbuffer())
             st.success(f"PDF file {uploaded_file.name} has been uploaded successfully!")
 
+def extract_pages(pdf_bytes, start, stop):
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        try:
+            pages = []
+            for index in range(start, stop):
+                page = pdf[index]
+                textpage = page.get_textpage()
+                pages.append(textpage.get_text_range().replace("\r\n", "\n"))
+                textpage.close()
+                page.close()
+            return pages
+        finally:
+            pdf.close()
+
+@st.cache_resource
+def get_extraction_pool():
+    # One pool per server process. Workers are spawned, not forked, so they
+    # never inherit a lock or PDFium state held by another session's thread
+    return ProcessPoolExecutor(
+        max_workers=os.cpu_count() or 1,
+        mp_context=multiprocessing.get_context("spawn")
+    )
+
 def read_document(document_folder, document_name):
     file_path = os.path.join(document_folder, document_name)
     if os.path.exists(file_path) and file_path.lower().endswith('.pdf'):
         with open(file_path, "rb") as f:
-            pdf_reader = PyPDF2.PdfReader(f)
-            num_pages = len(pdf_reader.pages)
-            content = ""
-            for page in range(num_pages):
-                content += pdf_reader.pages[page].extract_text() + "\n\n"
-        return content
+            pdf_bytes = f.read()
+        with PDFIUM_LOCK:
+            pdf = pdfium.PdfDocument(pdf_bytes)
+            num_pages = len(pdf)
+            pdf.close()
+        if num_pages <= PAGES_PER_TASK:
+            pages = extract_pages(pdf_bytes, 0, num_pages)
+        else:
+            # Text extraction is CPU-bound, so spread page batches over processes
+            starts = range(0, num_pages, PAGES_PER_TASK)
+            stops = [min(start + PAGES_PER_TASK, num_pages) for start in starts]
+            batches = get_extraction_pool().map(extract_pages, repeat(pdf_bytes), starts, stops)
+            pages = [page for batch in batches for page in batch]
+        return "".join(page + "\n\n" for page in pages)
     else:
         st.error(f"PDF file {document_name} not found in {document_folder}")
 